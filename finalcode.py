@@ -1,22 +1,49 @@
 import streamlit as st
+import csv
+import hashlib
+import hmac
+import io
+import os
 import sqlite3
-from datetime import datetime, date
-import geocoder
+import threading
+import time
+from datetime import datetime, date, timedelta
 import pandas as pd
+import requests
 
 DB_PATH = "geolocation.db"
+# Bump when migrate_columns() gains a new one-off data migration
+SCHEMA_VERSION = 1
 
 # ------------------ CONFIG ------------------
 ADMIN_USERNAME = "admin"
-ADMIN_PASSWORD = "12345"
+# The admin password comes from the environment and only its digest is kept; admin login is disabled if unset
+ADMIN_HASH = (hashlib.sha256(os.environ["ADMIN_PASSWORD"].encode()).hexdigest()
+              if os.environ.get("ADMIN_PASSWORD") else None)
 
 # ------------------ DB helpers ------------------
+# Serializes writers on the shared connection to avoid SQLITE_BUSY. Cached like
+# get_conn() because Streamlit re-executes this module on every rerun.
+@st.cache_resource
+def get_write_lock():
+    return threading.Lock()
+
+@st.cache_resource
 def get_conn():
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
+    # One connection per process, shared across reruns and sessions.
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+    # Per-connection tuning; journal_mode is persisted on the file by init_db().
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA cache_size=-64000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
 
 def init_db():
     conn = get_conn()
     c = conn.cursor()
+    # WAL lets admin reads run alongside user check-ins; it sticks to the DB file.
+    c.execute("PRAGMA journal_mode=WAL")
     c.execute("""
     CREATE TABLE IF NOT EXISTS attendance (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -34,8 +61,10 @@ def init_db():
         checkout_longitude REAL
     )
     """)
-    conn.commit()
-    conn.close()
+    # Indexes for the check-out lookup, per-user history and admin date filter
+    c.execute("CREATE INDEX IF NOT EXISTS idx_att_user_open ON attendance(username, checkout_time, id DESC)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_att_username ON attendance(username)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_att_checkin_date ON attendance(checkin_time)")
 
 def migrate_columns():
     conn = get_conn()
@@ -56,49 +85,185 @@ def migrate_columns():
     for col, col_type in new_cols.items():
         if col not in cols:
             c.execute(f"ALTER TABLE attendance ADD COLUMN {col} {col_type}")
-    conn.commit()
+
+    # Data migrations below are full-table scans; skip them once the file is up to date
+    if c.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
 
     # Migrate data: copy checkin_latitude/longitude into latitude/longitude where latitude/longitude are NULL
-    c.execute("""
-        UPDATE attendance
-        SET latitude = checkin_latitude,
-            longitude = checkin_longitude
-        WHERE (latitude IS NULL OR longitude IS NULL)
-          AND checkin_latitude IS NOT NULL
-          AND checkin_longitude IS NOT NULL
-    """)
-    conn.commit()
-    conn.close()
+    with get_write_lock(), conn:
+        # The connection is in autocommit mode, so open the transaction explicitly;
+        # the backfill and the version bump commit or roll back together
+        c.execute("BEGIN")
+        c.execute("""
+            UPDATE attendance
+            SET latitude = checkin_latitude,
+                longitude = checkin_longitude
+            WHERE (latitude IS NULL OR longitude IS NULL)
+              AND checkin_latitude IS NOT NULL
+              AND checkin_longitude IS NOT NULL
+        """)
+        c.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+# Streamlit re-executes this script on every interaction; set up the schema once per process
+@st.cache_resource
+def bootstrap_db():
+    init_db()
+    migrate_columns()
+    return True
 
 # ------------------ Location helper ------------------
+# Cached across reruns so the TCP/TLS connection to ipinfo is kept alive
+@st.cache_resource
+def get_http_session():
+    return requests.Session()
+
+# The server's public IP rarely changes within a session, so avoid a network
+# round-trip on every Check-In / Check-Out click. Failures raise and are not cached.
+@st.cache_data(ttl=300, show_spinner=False)
+def _lookup_ip_location():
+    resp = get_http_session().get("https://ipinfo.io/json", timeout=2)
+    resp.raise_for_status()
+    r = resp.json()
+    lat, lon = map(float, r["loc"].split(","))
+    address = ", ".join(filter(None, [
+        r.get("city"),
+        r.get("region"),
+        r.get("country")
+    ])) or "Unknown"
+    return lat, lon, address
+
 def get_ip_location():
     try:
-        g = geocoder.ip("me")
-        latlng = g.latlng
-        lat, lon = (float(latlng[0]), float(latlng[1])) if latlng else (None, None)
-        address = ", ".join(filter(None, [
-            getattr(g, "city", None),
-            getattr(g, "state", None),
-            getattr(g, "country", None)
-        ])) or "Unknown"
-        return lat, lon, address
+        return _lookup_ip_location()
     except Exception:
         return None, None, "Unknown"
 
-# Prepare DataFrame for st.map() with renamed lat/lon columns and dropping invalids
+# Prepare DataFrame for st.map() with only lat/lon columns, dropping invalids
 def prepare_map_df(df, lat_col, lon_col):
-    df = df.copy()
-    df[lat_col] = pd.to_numeric(df[lat_col], errors='coerce')
-    df[lon_col] = pd.to_numeric(df[lon_col], errors='coerce')
-    df_clean = df.dropna(subset=[lat_col, lon_col]).reset_index(drop=True)
-    return df_clean.rename(columns={lat_col: "lat", lon_col: "lon"})
+    lat = pd.to_numeric(df[lat_col], errors='coerce')
+    lon = pd.to_numeric(df[lon_col], errors='coerce')
+    mask = lat.notna() & lon.notna()
+    return pd.DataFrame({"lat": lat[mask].to_numpy(), "lon": lon[mask].to_numpy()})
+
+# Module-level so sqlite3's statement cache reuses the compiled plan; checkout columns default to NULL
+SQL_INSERT = ("INSERT INTO attendance(username, latitude, longitude, checkin_latitude, checkin_longitude, "
+              "address, checkin_time, checkin_remark) VALUES(?,?,?,?,?,?,?,?)")
+
+# Closes the user's most recent open check-in in one statement (RETURNING needs SQLite >= 3.35)
+SQL_CHECKOUT = """
+    UPDATE attendance
+    SET checkout_time=?, checkout_remark=?, checkout_latitude=?, checkout_longitude=?
+    WHERE id = (SELECT id FROM attendance WHERE username=? AND checkout_time IS NULL ORDER BY id DESC LIMIT 1)
+    RETURNING id
+"""
+
+# Rows per page in the history/admin tables
+PAGE_SIZE = 100
+
+# Columns shown in the history/admin tables; coordinates are fetched separately for the maps
+TABLE_COLS = "id, username, checkin_time, checkout_time, address, checkin_remark, checkout_remark"
+
+# One fixed WHERE text per filter shape with named binds (:user, :start, :end), so identical
+# filters always produce identical SQL and hit sqlite3's statement cache
+def _filter_sql(has_user, has_dates):
+    where = "1=1"
+    if has_user:
+        where += " AND username=:user"
+    if has_dates:
+        # checkin_time is stored as "%Y-%m-%d %H:%M:%S", so a plain string range
+        # is chronological and can use idx_att_checkin_date.
+        where += " AND checkin_time >= :start AND checkin_time < :end"
+    return where
+
+def attendance_filter(user=None, date_from=None, date_to=None):
+    has_dates = bool(date_from and date_to)
+    params = {}
+    if user:
+        params["user"] = user
+    if has_dates:
+        params["start"] = f"{date_from:%Y-%m-%d} 00:00:00"
+        params["end"] = f"{date_to + timedelta(days=1):%Y-%m-%d} 00:00:00"
+    return _filter_sql(bool(user), has_dates), params
+
+# Cached per filter/page so unrelated widget reruns don't re-query SQLite
+@st.cache_data(ttl=15, show_spinner=False)
+def load_attendance(user, date_from, date_to, page):
+    where, params = attendance_filter(user, date_from, date_to)
+    query = f"SELECT {TABLE_COLS} FROM attendance WHERE {where} ORDER BY id DESC LIMIT :limit OFFSET :offset"
+    return pd.read_sql_query(query, get_conn(), params={**params, "limit": PAGE_SIZE, "offset": (page - 1) * PAGE_SIZE})
+
+# Encode CSV straight from the cursor in chunks, without building a DataFrame
+def iter_csv_chunks(user, date_from, date_to, chunk_size=10_000):
+    where, params = attendance_filter(user, date_from, date_to)
+    cur = get_conn().execute(f"SELECT * FROM attendance WHERE {where} ORDER BY id DESC", params)
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow([d[0] for d in cur.description])
+    rows = cur.fetchmany(chunk_size)
+    while True:
+        writer.writerows(rows)
+        yield buf.getvalue().encode("utf-8")
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            return
+        buf.seek(0)
+        buf.truncate()
+
+# Full-column CSV for the admin export, encoded once per filter instead of on every rerun
+@st.cache_data(ttl=15, show_spinner=False)
+def export_csv(user, date_from, date_to):
+    return b"".join(iter_csv_chunks(user, date_from, date_to))
+
+# Maps cover the whole filter range, so cache them per filter like load_attendance
+@st.cache_data(ttl=15, show_spinner=False)
+def load_map_df(user, date_from, date_to, lat_col, lon_col):
+    where, params = attendance_filter(user, date_from, date_to)
+    query = (f"SELECT {lat_col}, {lon_col} FROM attendance WHERE {where}"
+             f" AND {lat_col} IS NOT NULL AND {lon_col} IS NOT NULL")
+    return prepare_map_df(pd.read_sql_query(query, get_conn(), params=params), lat_col, lon_col)
+
+@st.cache_data(ttl=30, show_spinner=False)
+def count_records(where, params):
+    return get_conn().execute(f"SELECT COUNT(*) FROM attendance WHERE {where}", params).fetchone()[0]
+
+def clear_attendance_caches():
+    count_records.clear()
+    load_attendance.clear()
+    export_csv.clear()
+    load_map_df.clear()
+
+# Bulk insert rows shaped like SQL_INSERT's parameters in a single transaction
+def record_batch(rows):
+    conn = get_conn()
+    try:
+        # The shared lock is held from BEGIN until conn's commit/rollback, so no other
+        # writer can commit or interleave with a half-finished batch
+        with get_write_lock(), conn:
+            # The connection is in autocommit mode, so open the transaction explicitly
+            conn.execute("BEGIN")
+            conn.executemany(SQL_INSERT, rows)
+    finally:
+        # Readers share this connection and may have cached uncommitted rows
+        clear_attendance_caches()
+
+# Ignore repeat Check-In / Check-Out clicks within this window (seconds)
+DEBOUNCE_SECONDS = 5
+
+def recently_clicked(key):
+    return st.session_state.get(key, 0) > time.time() - DEBOUNCE_SECONDS
+
+def select_page(total, key):
+    pages = max(1, -(-total // PAGE_SIZE))
+    page = st.number_input("Page", min_value=1, max_value=pages, step=1, key=key)
+    st.caption(f"Page {page} of {pages}")
+    return page
 
 # ------------------ APP SETUP ------------------
 st.set_page_config(page_title="Geolocation Attendance", layout="wide")
 st.title("📍 Geolocation Check-In / Check-Out (with Remarks)")
 
-init_db()
-migrate_columns()
+bootstrap_db()
 
 view_mode = st.sidebar.selectbox("Mode", ["User", "Admin"])
 username = st.text_input("Enter your name", max_chars=64) if view_mode == "User" else None
@@ -109,19 +274,17 @@ if view_mode == "User":
     if st.button("Check-In"):
         if not username.strip():
             st.error("Please enter your name.")
+        elif recently_clicked("last_checkin_ts"):
+            st.warning("⚠ Duplicate Check-In ignored.")
         else:
             lat, lon, address = get_ip_location()
             checkin_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             conn = get_conn()
-            c = conn.cursor()
-            c.execute("""
-                INSERT INTO attendance 
-                (username, latitude, longitude, checkin_latitude, checkin_longitude, address, checkin_time, checkin_remark, checkout_time, checkout_remark, checkout_latitude, checkout_longitude) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (username, lat, lon, lat, lon, address, checkin_time, checkin_remark, None, None, None, None))
-            conn.commit()
-            conn.close()
+            # Single statement, autocommitted on the shared connection
+            with get_write_lock():
+                conn.execute(SQL_INSERT, (username, lat, lon, lat, lon, address, checkin_time, checkin_remark))
+            clear_attendance_caches()
+            st.session_state["last_checkin_ts"] = time.time()
             st.success(f"✅ Checked in at {checkin_time}")
             st.write(f"🏠 {address}")
 
@@ -130,44 +293,41 @@ if view_mode == "User":
     if st.button("Check-Out"):
         if not username.strip():
             st.error("Please enter your name.")
+        elif recently_clicked("last_checkout_ts"):
+            st.warning("⚠ Duplicate Check-Out ignored.")
         else:
+            lat, lon, _ = get_ip_location()
+            checkout_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             conn = get_conn()
-            c = conn.cursor()
-            c.execute("SELECT id FROM attendance WHERE username=? AND checkout_time IS NULL ORDER BY id DESC LIMIT 1", (username,))
-            row = c.fetchone()
-            if row:
-                record_id = row[0]
-                lat, lon, _ = get_ip_location()
-                checkout_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                c.execute("""
-                    UPDATE attendance 
-                    SET checkout_time=?, checkout_remark=?, checkout_latitude=?, checkout_longitude=? 
-                    WHERE id=?
-                    """,
-                    (checkout_time, checkout_remark, lat, lon, record_id))
-                conn.commit()
-                conn.close()
+            # Single statement, autocommitted; fetchall() runs it to completion so
+            # SQLite's write lock is released before ours
+            with get_write_lock():
+                closed = conn.execute(SQL_CHECKOUT, (checkout_time, checkout_remark, lat, lon, username)).fetchall()
+            if closed:
+                clear_attendance_caches()
+                st.session_state["last_checkout_ts"] = time.time()
                 st.success(f"✅ Checked out at {checkout_time}")
             else:
                 st.warning("⚠ No active check-in found.")
 
     if st.checkbox("Show My Attendance History"):
         if username.strip():
-            conn = get_conn()
-            df = pd.read_sql_query("SELECT * FROM attendance WHERE username=? ORDER BY id DESC", conn, params=(username,))
-            conn.close()
-            if not df.empty:
+            where, params = attendance_filter(username)
+            total = count_records(where, params)
+            if total:
+                page = select_page(total, "history_page")
+                df = load_attendance(username, None, None, page)
                 st.dataframe(df)
 
                 st.write("🟢 Check-In Locations")
-                checkin_map_df = prepare_map_df(df, "checkin_latitude", "checkin_longitude")
+                checkin_map_df = load_map_df(username, None, None, "checkin_latitude", "checkin_longitude")
                 if not checkin_map_df.empty:
                     st.map(checkin_map_df)
                 else:
                     st.info("No valid check-in location data to show.")
 
                 st.write("🔴 Check-Out Locations")
-                checkout_map_df = prepare_map_df(df, "checkout_latitude", "checkout_longitude")
+                checkout_map_df = load_map_df(username, None, None, "checkout_latitude", "checkout_longitude")
                 if not checkout_map_df.empty:
                     st.map(checkout_map_df)
                 else:
@@ -178,13 +338,16 @@ if view_mode == "User":
             st.info("Enter your name to view history.")
 
 elif view_mode == "Admin":
-    if not st.session_state.get("admin_logged_in", False):
+    if ADMIN_HASH is None:
+        st.error("Admin login is disabled: set the ADMIN_PASSWORD environment variable.")
+    elif not st.session_state.get("admin_logged_in", False):
         st.subheader("🔐 Admin Login")
         admin_user = st.text_input("Username", key="admin_user")
         admin_pass = st.text_input("Password", type="password", key="admin_pass")
 
         if st.button("Login as Admin"):
-            if admin_user == ADMIN_USERNAME and admin_pass == ADMIN_PASSWORD:
+            pass_hash = hashlib.sha256(admin_pass.encode()).hexdigest()
+            if hmac.compare_digest(admin_user.encode(), ADMIN_USERNAME.encode()) and hmac.compare_digest(pass_hash, ADMIN_HASH):
                 st.session_state["admin_logged_in"] = True
                 st.success("✅ Logged in as Admin")
                 st.experimental_rerun()
@@ -198,7 +361,9 @@ elif view_mode == "Admin":
             st.experimental_rerun()
 
         conn = get_conn()
-        all_users = [r[0] for r in conn.execute("SELECT DISTINCT username FROM attendance").fetchall() if r[0]]
+        all_users = [r[0] for r in conn.execute(
+            "SELECT DISTINCT username FROM attendance WHERE username IS NOT NULL AND username<>'' ORDER BY username"
+        )]
         selected_user = st.selectbox("Filter by user", ["All"] + all_users)
         col1, col2 = st.columns(2)
         with col1:
@@ -206,38 +371,31 @@ elif view_mode == "Admin":
         with col2:
             date_to = st.date_input("To date", value=date.today())
 
-        query = "SELECT * FROM attendance WHERE 1=1"
-        params = []
-        if selected_user != "All":
-            query += " AND username=?"
-            params.append(selected_user)
-        start_str = date_from.strftime("%Y-%m-%d")
-        end_str = date_to.strftime("%Y-%m-%d")
-        query += " AND substr(checkin_time,1,10) BETWEEN ? AND ?"
-        params.extend([start_str, end_str])
-        query += " ORDER BY id DESC"
-
-        df = pd.read_sql_query(query, conn, params=params)
-        conn.close()
-
-        st.write(f"Showing {len(df)} records")
+        filter_user = None if selected_user == "All" else selected_user
+        where, params = attendance_filter(filter_user, date_from, date_to)
+
+        total = count_records(where, params)
+        page = select_page(total, "admin_page")
+        df = load_attendance(filter_user, date_from, date_to, page)
+
+        st.write(f"Showing {len(df)} of {total} records")
         st.dataframe(df)
 
-        if not df.empty:
+        if total:
             st.write("🟢 Check-In Locations")
-            checkin_map_df = prepare_map_df(df, "checkin_latitude", "checkin_longitude")
+            checkin_map_df = load_map_df(filter_user, date_from, date_to, "checkin_latitude", "checkin_longitude")
             if not checkin_map_df.empty:
                 st.map(checkin_map_df)
             else:
                 st.info("No valid check-in location data to show.")
 
             st.write("🔴 Check-Out Locations")
-            checkout_map_df = prepare_map_df(df, "checkout_latitude", "checkout_longitude")
+            checkout_map_df = load_map_df(filter_user, date_from, date_to, "checkout_latitude", "checkout_longitude")
             if not checkout_map_df.empty:
                 st.map(checkout_map_df)
             else:
                 st.info("No valid check-out location data to show.")
 
             # Now do NOT drop latitude/longitude columns from CSV export
-            csv = df.to_csv(index=False).encode("utf-8")
-            st.download_button("⬇ Download CSV", data=csv, file_name="attendance_export.csv", mime="text/csv")
+            csv_bytes = export_csv(filter_user, date_from, date_to)
+            st.download_button("⬇ Download CSV", data=csv_bytes, file_name="attendance_export.csv", mime="text/csv")